@@ -1,18 +1,43 @@
 import akshare as ak
+import numpy as np
 import pandas as pd
 from cachetools import cached, TTLCache
+from cachetools.keys import hashkey
+from functools import partial
+from diskcache import Cache
 from dotenv import load_dotenv
 import os
 import logging
 import asyncio
+import threading
+import httpx
 from tenacity import retry, stop_after_attempt, wait_fixed
 import json 
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone
+from rate_limiter import TokenBucket
 
 logger = logging.getLogger(__name__)
 load_dotenv(override=True) 
 
 CACHE_EXPIRE = int(os.getenv('CACHE_EXPIRE_SECONDS', '60')) 
+# ETF与A股实时行情共用同一个TTL缓存，各自使用独立的缓存键
 cache = TTLCache(maxsize=10, ttl=CACHE_EXPIRE)
+cache_lock = threading.Lock()
+# 相对路径以脚本所在目录为基准，避免受启动时工作目录影响（缓存在导入时创建，早于 main.py 切换目录）
+HIST_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv('HIST_CACHE_DIR', '.cache/hist'))
+AK_CONCURRENCY = int(os.getenv('AK_CONCURRENCY', '6'))
+# 每秒最多发送的日K线请求数，0表示不限制（仅受 AK_CONCURRENCY 并发数约束）
+AK_RPS = float(os.getenv('AK_RPS', '0'))
+_kline_bucket = TokenBucket(AK_RPS, burst=AK_CONCURRENCY)
+hist_cache = Cache(HIST_CACHE_DIR)
+_spot_locks = defaultdict(asyncio.Lock)
+# akshare 的 fund_etf_hist_em / stock_zh_a_hist 所请求的东方财富日K线接口
+EM_KLINE_URL = "https://push2his.eastmoney.com/api/qt/stock/kline/get"
+EM_KLINE_COLUMNS = ['日期', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
+_http_client = None
+# A股交易时间以北京时间为准（无夏令时）
+SHANGHAI_TZ = timezone(timedelta(hours=8))
 
 def _load_pool_from_env(env_var_name: str, default_pool: list = None):
     """从环境变量加载JSON格式的观察池"""
@@ -36,7 +61,113 @@ DEFAULT_STOCK_POOL = [
 ]
 CORE_STOCK_POOL = _load_pool_from_env('CORE_STOCK_POOL_JSON', DEFAULT_STOCK_POOL)
 
-@cached(cache)
+def index_pool(pool: list):
+    """将观察池预处理为去重后的代码数组及代码到名称的映射"""
+    names_by_code = {}
+    for item in pool:
+        names_by_code.setdefault(item['code'], item.get('name'))
+    return np.array(list(names_by_code), dtype=object), names_by_code
+
+CORE_ETF_CODES, CORE_ETF_NAMES_BY_CODE = index_pool(CORE_ETF_POOL)
+CORE_STOCK_CODES, CORE_STOCK_NAMES_BY_CODE = index_pool(CORE_STOCK_POOL)
+
+def _em_market_id(code: str):
+    """东方财富 secid 中的市场编号：沪市（5、6开头）为1，深市及北交所为0"""
+    return 1 if code.startswith(('5', '6')) else 0
+
+def _get_http_client():
+    """惰性创建进程内共享的 httpx.AsyncClient，所有日线请求复用同一个连接池"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(15.0, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _http_client
+
+async def close_http_client():
+    """关闭共享的 httpx.AsyncClient"""
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+
+async def _fetch_em_daily_kline(code: str, start_date: str = "19700101", end_date: str = "20500101"):
+    """直接请求 akshare 所封装的东方财富日K线接口（前复权），返回与 akshare 相同列名的DataFrame"""
+    params = {
+        "fields1": "f1,f2,f3,f4,f5,f6",
+        "fields2": "f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61",
+        "ut": "7eea3edcaed734bea9cbfc24409ed989",
+        "klt": "101",  # 日线
+        "fqt": "1",  # 前复权
+        "secid": f"{_em_market_id(code)}.{code}",
+        "beg": start_date,
+        "end": end_date,
+    }
+    await _kline_bucket.wait()
+    response = await _get_http_client().get(EM_KLINE_URL, params=params)
+    response.raise_for_status()
+    data = response.json().get('data')
+    if not data or not data.get('klines'):
+        return pd.DataFrame()
+    daily_df = pd.DataFrame([line.split(',') for line in data['klines']], columns=EM_KLINE_COLUMNS)
+    daily_df['日期'] = pd.to_datetime(daily_df['日期'], format='%Y-%m-%d', errors='coerce').dt.date
+    numeric_cols = EM_KLINE_COLUMNS[1:]
+    daily_df[numeric_cols] = daily_df[numeric_cols].apply(pd.to_numeric, errors='coerce')
+    return daily_df
+
+def _is_same_bar(cached_row, fresh_row):
+    """判断缓存与新获取的同一根K线是否一致（前复权数据在除权后会整体变化）"""
+    return (pd.to_datetime(cached_row['日期']) == pd.to_datetime(fresh_row['日期'])
+            and np.isclose(float(cached_row['收盘']), float(fresh_row['收盘'])))
+
+def _is_bar_settled(last_bar_date, fetched_at, now=None):
+    """缓存获取于最后一根K线所在交易日收盘之后、且下一交易日尚未开盘时，缓存的日线数据不会再变化（周末顺延至周一）"""
+    if fetched_at is None:
+        return False
+    now = now or datetime.now(SHANGHAI_TZ)
+    days_to_next_open = 3 if last_bar_date.weekday() == 4 else 1
+    settled_from = datetime.combine(last_bar_date, time(15, 30), SHANGHAI_TZ)
+    next_open = datetime.combine(last_bar_date + timedelta(days=days_to_next_open), time(9, 15), SHANGHAI_TZ)
+    return settled_from <= fetched_at and now < next_open
+
+def _load_cached_history(cache_key):
+    """读取日线缓存，返回 (获取时间, DataFrame)；旧版本缓存未记录获取时间，视为 None"""
+    cached = hist_cache.get(cache_key)
+    if isinstance(cached, tuple):
+        return cached
+    return None, cached
+
+def _store_history(cache_key, daily_df):
+    """连同获取时间一起写入日线缓存"""
+    hist_cache.set(cache_key, (datetime.now(SHANGHAI_TZ), daily_df))
+
+async def _get_daily_history_incremental(kind: str, code: str):
+    """从磁盘缓存读取日线数据，只增量拉取缓存中最后两根K线之后的数据"""
+    cache_key = f"{kind}:{code}"
+    fetched_at, cached_df = _load_cached_history(cache_key)
+    if (cached_df is not None and not cached_df.empty
+            and _is_bar_settled(pd.to_datetime(cached_df['日期'].iloc[-1]).date(), fetched_at)):
+        # 缓存获取于收盘之后，到下一交易日开盘前重复运行时直接使用缓存，无需请求网络
+        return cached_df
+    if cached_df is not None and len(cached_df) >= 2:
+        # 倒数第二根K线一定已收盘，用它校验复权因子是否变化；最后一根可能是盘中数据，需重新获取
+        start_date = pd.to_datetime(cached_df['日期'].iloc[-2]).strftime('%Y%m%d')
+        tail_df = await _fetch_em_daily_kline(code, start_date=start_date)
+        if not tail_df.empty and _is_same_bar(cached_df.iloc[-2], tail_df.iloc[0]):
+            daily_df = pd.concat([cached_df.iloc[:-2], tail_df], ignore_index=True)
+            _store_history(cache_key, daily_df)
+            return daily_df
+        logger.info(f"{code} 的缓存日线数据已失效（可能发生除权），重新获取完整历史数据...")
+    daily_df = await _fetch_em_daily_kline(code)
+    if not daily_df.empty:
+        _store_history(cache_key, daily_df)
+    return daily_df
+
+async def fetch_spot_realtime(get_realtime_data_func):
+    """在锁保护下获取实时行情：缓存过期时只有一个协程真正请求AKShare，其余协程等待并共享缓存结果"""
+    async with _spot_locks[get_realtime_data_func.__name__]:
+        return await asyncio.to_thread(get_realtime_data_func)
+
+@cached(cache, key=partial(hashkey, 'etf_spot'), lock=cache_lock)
 def get_all_etf_spot_realtime():
     """获取所有ETF的实时行情数据 (带缓存)"""
     logger.info("正在从AKShare获取所有ETF实时数据...(缓存有效期: %s秒)", CACHE_EXPIRE)
@@ -46,10 +177,16 @@ def get_all_etf_spot_realtime():
         for col in numeric_cols:
             df[col] = pd.to_numeric(df[col], errors='coerce')
         df.dropna(subset=numeric_cols, inplace=True)
-        # 计算涨跌幅
-        df['涨跌幅'] = 0.0
-        mask = df['昨收'] != 0
-        df.loc[mask, '涨跌幅'] = ((df.loc[mask, '最新价'] - df.loc[mask, '昨收']) / df.loc[mask, '昨收']) * 100
+        # 计算涨跌幅（昨收为0时记为0）
+        last = df['最新价'].to_numpy(dtype=np.float64)
+        prev = df['昨收'].to_numpy(dtype=np.float64)
+        df['涨跌幅'] = np.divide(last - prev, prev, out=np.zeros_like(last), where=prev != 0) * 100
+        # 以代码建立索引（保留代码列），缓存期内的所有调用方都可直接按代码查找
+        df.drop_duplicates(subset='代码', inplace=True)
+        df.set_index('代码', drop=False, inplace=True)
+        df.index.name = None
+        # 索引保留字符串代码用于哈希查找，代码列转为category以降低内存并加快按代码的等值比较
+        df['代码'] = df['代码'].astype('category')
         return df
     except Exception as e:
         logger.error(f" 获取ETF实时数据失败: {e}", exc_info=True)
@@ -57,20 +194,14 @@ def get_all_etf_spot_realtime():
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
 async def get_etf_daily_history(etf_code: str):
-    """获取单支ETF的历史日线数据 (带自动重试)"""
+    """获取单支ETF的历史日线数据 (带磁盘缓存和自动重试)"""
     logger.info(f"正在获取 {etf_code} 的历史日线数据...")
     try:
-        daily_df = await asyncio.to_thread(
-            ak.fund_etf_hist_em,
-            symbol=etf_code,
-            period="daily",
-            adjust="qfq"
-        )
-        return daily_df
+        return await _get_daily_history_incremental('etf', etf_code)
     except Exception as e:
         logger.warning(f"⚠️ 获取 {etf_code} 日线数据时出错 (将进行重试): {e}")
         raise e
-@cached(cache)
+@cached(cache, key=partial(hashkey, 'stock_spot'), lock=cache_lock)
 def get_all_stock_spot_realtime():
     """获取所有A股的实时行情数据 (带缓存)"""
     logger.info("正在从AKShare获取所有A股实时数据...(缓存有效期: %s秒)", CACHE_EXPIRE)
@@ -81,10 +212,16 @@ def get_all_stock_spot_realtime():
         for col in numeric_cols:
             df[col] = pd.to_numeric(df[col], errors='coerce')
         df.dropna(subset=numeric_cols, inplace=True)
-        # 计算涨跌幅
-        df['涨跌幅'] = 0.0
-        mask = df['昨收'] != 0
-        df.loc[mask, '涨跌幅'] = ((df.loc[mask, '最新价'] - df.loc[mask, '昨收']) / df.loc[mask, '昨收'])
+        # 计算涨跌幅（昨收为0时记为0）
+        last = df['最新价'].to_numpy(dtype=np.float64)
+        prev = df['昨收'].to_numpy(dtype=np.float64)
+        df['涨跌幅'] = np.divide(last - prev, prev, out=np.zeros_like(last), where=prev != 0)
+        # 以代码建立索引（保留代码列），缓存期内的所有调用方都可直接按代码查找
+        df.drop_duplicates(subset='代码', inplace=True)
+        df.set_index('代码', drop=False, inplace=True)
+        df.index.name = None
+        # 索引保留字符串代码用于哈希查找，代码列转为category以降低内存并加快按代码的等值比较
+        df['代码'] = df['代码'].astype('category')
         return df
     except Exception as e:
         logger.error(f" 获取股票实时数据失败: {e}", exc_info=True)
@@ -92,17 +229,24 @@ def get_all_stock_spot_realtime():
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
 async def get_stock_daily_history(stock_code: str):
-    """获取单支股票的历史日线数据 (带自动重试)"""
+    """获取单支股票的历史日线数据 (带磁盘缓存和自动重试)"""
     logger.info(f"正在获取 {stock_code} 的历史日线数据...")
     try:
-        # 使用专门获取股票历史数据的接口
-        daily_df = await asyncio.to_thread(
-            ak.stock_zh_a_hist,
-            symbol=stock_code,
-            period="daily",
-            adjust="qfq"  # 使用前复权数据
-        )
-        return daily_df
+        return await _get_daily_history_incremental('stock', stock_code)
     except Exception as e:
         logger.warning(f" 获取 {stock_code} 日线数据时出错 (将进行重试): {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+async def iter_daily_histories(get_daily_history_func, codes):
+    """并发获取多个标的的日线数据（并发数受 AK_CONCURRENCY 限制），按完成顺序逐个产出 (代码, DataFrame或获取时的异常)"""
+    sem = asyncio.Semaphore(AK_CONCURRENCY)
+
+    async def _fetch(code):
+        async with sem:
+            try:
+                return code, await get_daily_history_func(code)
+            except Exception as e:
+                return code, e
+
+    for next_done in asyncio.as_completed([_fetch(code) for code in dict.fromkeys(codes)]):
+        yield await next_done
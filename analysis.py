@@ -1,23 +1,56 @@
 import asyncio
+import hashlib
+import heapq
+import inspect
 import logging
-import random
+import os
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import pandas_ta as ta
+from diskcache import Cache
+try:
+    import talib
+except ImportError:
+    talib = None
 from ak_utils import (
     get_all_etf_spot_realtime, get_etf_daily_history, CORE_ETF_POOL,
-    get_all_stock_spot_realtime, get_stock_daily_history, CORE_STOCK_POOL
+    get_all_stock_spot_realtime, get_stock_daily_history, CORE_STOCK_POOL,
+    fetch_spot_realtime, iter_daily_histories, index_pool,
+    CORE_ETF_CODES, CORE_ETF_NAMES_BY_CODE, CORE_STOCK_CODES, CORE_STOCK_NAMES_BY_CODE
 )
-from llm_analyzer import get_llm_score_and_analysis
+from llm_analyzer import get_llm_scores_batched
 from indicators import analyze_ma, analyze_macd, analyze_bollinger
+from indicators import sma_tail, macd, bbands_tail, BOLLINGER_CROSS_DAYS, SMA_LENGTHS
 from indicators import judge_trend_status
+import indicators
 
 logger = logging.getLogger(__name__)
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', '4'))
+LLM_BATCH_SIZE = max(1, int(os.getenv('LLM_BATCH_SIZE', '8')))
+REPORT_TOP_K = int(os.getenv('REPORT_TOP_K', '0'))
+# 指标计算使用的子进程数，0表示在线程中执行
+ANALYSIS_PROCESSES = int(os.getenv('ANALYSIS_PROCESSES', '0'))
+# 相对路径以脚本所在目录为基准，避免受启动时工作目录影响（缓存在导入时创建，早于 main.py 切换目录）
+TREND_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv('TREND_CACHE_DIR', '.cache/trend'))
+TREND_CACHE_EXPIRE = 7 * 24 * 3600
+# 历史数据中可能的收盘价列名（akshare/东方财富为'收盘'），按顺序取第一个存在的列
+_CLOSE_COLUMNS = ('收盘', 'Close', 'close')
 pd.set_option('display.max_rows', None) 
 pd.set_option('display.max_columns', None) 
 
-async def generate_ai_driven_report(get_realtime_data_func, get_daily_history_func, core_pool):
+# 日线数据缺失或计算失败时 _trend_record 使用的状态前缀
+_NO_TREND_STATUS_PREFIXES = ('🟡 数据', '❌')
+
+def _lacks_daily_trend(daily_trend):
+    """日线趋势缺失、数据不足或分析失败时返回True"""
+    status = daily_trend.get('status') if daily_trend else None
+    return not status or status == '未知' or status.startswith(_NO_TREND_STATUS_PREFIXES)
+
+async def generate_ai_driven_report(get_realtime_data_func, get_daily_history_func, core_pool, top_k=None, on_progress=None):
+    """生成AI综合评分报告；on_progress 为可选的异步回调 (已完成批数, 总批数)，每批LLM分析完成时调用"""
     logger.info("启动AI驱动的统一全面分析引擎...")
-    realtime_data_df_task = asyncio.to_thread(get_realtime_data_func)
+    realtime_data_df_task = fetch_spot_realtime(get_realtime_data_func)
     daily_trends_task = _get_daily_trends_generic(get_daily_history_func, core_pool)
     realtime_data_df, daily_trends_list = await asyncio.gather(realtime_data_df_task, daily_trends_task)
     if realtime_data_df is None:
@@ -29,145 +62,259 @@ async def generate_ai_driven_report(get_realtime_data_func, get_daily_history_fu
         item_type = "etf"
     intraday_analyzer = _IntradaySignalGenerator(core_pool, item_type=item_type)
     intraday_signals = intraday_analyzer.generate_signals(realtime_data_df)
-    final_report = []
-    for i, signal in enumerate(intraday_signals):
-        code = signal['code']
-        name = signal['name']
-        logger.info(f"正在调用LLM分析: {name} ({i+1}/{len(intraday_signals)})")
-        try:
-            daily_trend = daily_trends_map.get(code, {'status': '未知'})
-            ai_score, ai_comment = await get_llm_score_and_analysis(signal, daily_trend)
-            final_report.append({
-                **signal,
-                "ai_score": ai_score if ai_score is not None else 0,
-                "ai_comment": ai_comment
-            })
-        except Exception as e:
-            logger.error(f"处理LLM分析 {name} 时发生错误: {e}")
-            final_report.append({**signal, "ai_score": 0, "ai_comment": "处理时发生未知错误。"})
-        await asyncio.sleep(random.uniform(1.0, 2.5))
-    return sorted(final_report, key=lambda x: x.get('ai_score', 0), reverse=True)
+    if not intraday_signals:
+        logger.warning("实时行情中没有匹配观察池的标的，跳过LLM分析。")
+        return []
+    # 日线数据缺失或分析失败的标的无法给出有意义的评分，直接给中性分，不占用LLM请求
+    scorable_signals, skipped_report = [], []
+    for signal in intraday_signals:
+        if _lacks_daily_trend(daily_trends_map.get(signal['code'])):
+            logger.debug(f"{signal['name']} 日线数据不足，跳过AI评分")
+            skipped_report.append({**signal, "ai_score": 50, "ai_comment": "日线数据不足，跳过AI评分。"})
+        else:
+            scorable_signals.append(signal)
+    if skipped_report:
+        logger.info(f"{len(skipped_report)} 个标的日线数据不足，跳过AI评分")
+    sem = asyncio.Semaphore(LLM_CONCURRENCY)
+    batches = [scorable_signals[i:i + LLM_BATCH_SIZE] for i in range(0, len(scorable_signals), LLM_BATCH_SIZE)]
 
-async def _get_daily_trends_generic(get_daily_history_func, core_pool):
-    analysis_report = []
-    for item_info in core_pool:
+    async def _score_batch(batch_no, batch):
+        async with sem:
+            logger.info(f"正在调用LLM批量分析: 第 {batch_no+1}/{len(batches)} 批，共 {len(batch)} 个标的")
+            try:
+                items = [(signal, daily_trends_map.get(signal['code'], {'status': '未知'})) for signal in batch]
+                scores = await get_llm_scores_batched(items)
+                return batch_no, [
+                    {
+                        **signal,
+                        "ai_score": ai_score if ai_score is not None else 0,
+                        "ai_comment": ai_comment
+                    }
+                    for signal, (ai_score, ai_comment) in zip(batch, scores)
+                ]
+            except Exception as e:
+                logger.error(f"处理LLM批量分析第 {batch_no+1} 批时发生错误: {e}")
+                return batch_no, [{**signal, "ai_score": 0, "ai_comment": "处理时发生未知错误。"} for signal in batch]
+
+    # 按完成顺序收集各批结果，每完成一批即汇报进度，无需等待最慢的LLM请求
+    batch_reports = [None] * len(batches)
+    scored = 0
+    for done, next_batch in enumerate(asyncio.as_completed([_score_batch(i, batch) for i, batch in enumerate(batches)]), 1):
+        batch_no, batch_report = await next_batch
+        batch_reports[batch_no] = batch_report
+        scored += len(batch_report)
+        logger.info(f"LLM分析进度: {done}/{len(batches)} 批，已完成 {scored}/{len(scorable_signals)} 个标的")
+        if on_progress is not None:
+            try:
+                await on_progress(done, len(batches))
+            except Exception as e:
+                logger.warning(f"进度回调执行失败: {e}")
+    # 按批次原顺序合并，评分相同的标的排序结果保持稳定；每条结果都已带有 ai_score，可直接按键排序
+    final_report = [report_item for batch_report in batch_reports for report_item in batch_report] + skipped_report
+    top_k = REPORT_TOP_K if top_k is None else top_k
+    if top_k > 0:
+        # 只需评分最高的前top_k个标的时使用堆选择，无需对全部结果排序
+        return heapq.nlargest(top_k, final_report, key=itemgetter('ai_score'))
+    return sorted(final_report, key=itemgetter('ai_score'), reverse=True)
+
+def _indicator_frame(close_np, tail=BOLLINGER_CROSS_DAYS):
+    """
+    计算均线、MACD和布林通道（已安装TA-Lib时使用TA-Lib，否则使用 indicators 中的numba内核），
+    只保留最后tail根K线构建紧凑的DataFrame供分析函数使用，不向原始历史数据中追加列
+    """
+    if talib is None:
+        # 均线只在最后两根K线上被读取，无需计算完整历史
+        smas = sma_tail(close_np, SMA_LENGTHS, 2)
+        sma_columns = {f'SMA_{length}': smas[:, j] for j, length in enumerate(SMA_LENGTHS)}
+        macd_line, macd_signal, macd_hist = macd(close_np, 12, 26, 9)
+        # 布林通道只在最近几个交易日被读取，无需计算完整历史
+        lower, middle, upper = bbands_tail(close_np, 20, 2.0, tail)
+    else:
+        sma_columns = {f'SMA_{length}': talib.SMA(close_np, timeperiod=length) for length in SMA_LENGTHS}
+        macd_line, macd_signal, macd_hist = talib.MACD(close_np, fastperiod=12, slowperiod=26, signalperiod=9)
+        upper, middle, lower = talib.BBANDS(close_np, timeperiod=20, nbdevup=2.0, nbdevdn=2.0)
+    # 列名与 pandas_ta 保持一致，供 indicators 中的分析函数使用
+    columns = {
+        'close': close_np,
+        **sma_columns,
+        'MACD_12_26_9': macd_line,
+        'MACDh_12_26_9': macd_hist,
+        'MACDs_12_26_9': macd_signal,
+        'BBL_20_2.0': lower,
+        'BBM_20_2.0': middle,
+        'BBU_20_2.0': upper,
+    }
+    return pd.DataFrame({name: values[-tail:] for name, values in columns.items()})
+
+# {版本:后端:代码:收盘价序列摘要: (状态, 信号列表, 调试数据)}，跨进程复用收盘价未变化标的的趋势分析结果
+trend_cache = Cache(TREND_CACHE_DIR)
+
+_trend_logic_digest = None
+
+def _trend_logic_version():
+    """由 indicators.py 及本模块指标计算/趋势判定函数的源码生成版本号，修改逻辑或信号文案后旧的趋势缓存自动失效"""
+    global _trend_logic_digest
+    if _trend_logic_digest is None:
+        h = hashlib.blake2b(digest_size=8)
+        for obj in (indicators, _indicator_frame, _analyze_close):
+            try:
+                h.update(inspect.getsource(obj).encode('utf-8'))
+            except (OSError, TypeError):
+                # 无法读取源码（如仅有 .pyc）时退回使用源文件修改时间
+                h.update(str(os.path.getmtime(inspect.getfile(obj))).encode('utf-8'))
+        _trend_logic_digest = h.hexdigest()
+    return _trend_logic_digest
+
+def _trend_cache_key(code, close_np):
+    """趋势分析结果取决于分析逻辑版本、指标计算后端（TA-Lib与内置numba实现的MACD初值不同）和收盘价序列"""
+    backend = 'talib' if talib is not None else 'numba'
+    digest = hashlib.blake2b(close_np.tobytes(), digest_size=16).hexdigest()
+    return f"v{_trend_logic_version()}:{backend}:{code}:{digest}"
+
+def _trend_record(item_info, status, summary, debug, raw_debug_data=None):
+    """构建日线趋势结果，仅在调试模式下附带 raw_debug_data"""
+    record = {'code': item_info['code'], 'name': item_info.get('name'),
+              'status': status, 'technical_indicators_summary': summary}
+    if debug:
+        record['raw_debug_data'] = raw_debug_data or {}
+    return record
+
+def _extract_close(result, item_info, debug=False):
+    """字段标准化并校验历史数据，返回float64收盘价数组；数据不可用时返回对应的趋势结果"""
+    if result is None or result.empty:
+        return _trend_record(item_info, '🟡 数据不足', ["历史数据为空或无法获取。"], debug)
+    # 后续只使用收盘价数组，直接定位收盘价列，无需重命名整张表或处理日期索引及最高/最低价列
+    close_col = next((col for col in _CLOSE_COLUMNS if col in result.columns), None)
+    if close_col is None:
+        return _trend_record(item_info, '🟡 数据列缺失', ["获取到的历史数据缺少必要的'close'列。"], debug)
+    n = len(result)
+    if n < 60:
+        return _trend_record(item_info, '🟡 数据不足 (少于60天)', ["历史数据不足60天，部分长期指标无法计算。"], debug)
+    close = result[close_col]
+    # ak_utils 返回的收盘价已是float64，只有其他类型才需要逐元素转换
+    if close.dtype != np.float64:
+        close = pd.to_numeric(close, errors='coerce')
+    close_np = close.to_numpy(dtype=np.float64)
+    if np.isnan(close_np).all():
+        return _trend_record(item_info, '🟡 数据计算失败', ["'close' 列数据全为空值，无法计算指标。"], debug)
+    return close_np
+
+def _analyze_close(close_np, debug=False):
+    """由收盘价数组计算指标并完成趋势判定，返回 (状态, 信号列表, 调试数据)；只接收和返回可序列化的简单对象，可在子进程中执行"""
+    frame = _indicator_frame(close_np)
+    # 最后两根K线只取一次底层numpy行，分析函数按列位置读取，避免构建Series
+    prev_latest, latest = frame.to_numpy()[-2:]
+    trend_signals = []
+
+    analyze_ma(frame, latest, prev_latest, trend_signals)
+    analyze_macd(frame, latest, prev_latest, trend_signals)
+    analyze_bollinger(frame, latest, prev_latest, trend_signals)
+
+    # --- 状态判定 ---
+    status = judge_trend_status(frame, latest, prev_latest)
+    raw_debug_data = dict(zip(frame.columns, latest.tolist())) if debug else None
+    return status, trend_signals, raw_debug_data
+
+_process_pool = None
+
+async def _run_cpu_bound(func, *args):
+    """CPU密集型任务：配置了 ANALYSIS_PROCESSES 时交给进程池，否则放到线程中执行（numba内核不持有GIL）"""
+    global _process_pool
+    if ANALYSIS_PROCESSES <= 0:
+        return await asyncio.to_thread(func, *args)
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=ANALYSIS_PROCESSES)
+    return await asyncio.get_running_loop().run_in_executor(_process_pool, func, *args)
+
+def shutdown_process_pool():
+    """关闭指标计算进程池并取消未开始的任务，避免解释器退出时阻塞等待子进程"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+async def _compute_indicators_and_signals(result, item_info, debug=False):
+    """完成单个标的的字段标准化、指标计算与趋势判定"""
+    close_np = _extract_close(result, item_info, debug)
+    if isinstance(close_np, dict):
+        return close_np
+    # 收盘价未变化（如收盘后重复运行）时直接复用上次的结果，跳过指标计算
+    cache_key = _trend_cache_key(item_info['code'], close_np)
+    cached = trend_cache.get(cache_key)
+    if cached is not None and (cached[2] is not None or not debug):
+        return _trend_record(item_info, *cached[:2], debug, cached[2])
+
+    status, trend_signals, raw_debug_data = await _run_cpu_bound(_analyze_close, close_np, debug)
+    trend_cache.set(cache_key, (status, trend_signals, raw_debug_data), expire=TREND_CACHE_EXPIRE)
+    return _trend_record(item_info, status, trend_signals, debug, raw_debug_data)
+
+async def _get_daily_trends_generic(get_daily_history_func, core_pool, debug=False):
+    async def _analyze_one(item_info, result):
         try:
-            result = await get_daily_history_func(item_info['code'])
-            if result is None or result.empty:
-                analysis_report.append({**item_info, 'status': '🟡 数据不足', 'technical_indicators_summary': ["历史数据为空或无法获取。"], 'raw_debug_data': {}})
-                continue
-            # 字段标准化
-            if '收盘' in result.columns: 
-                result.rename(columns={'收盘': 'close'}, inplace=True)
-            elif 'close' not in result.columns and 'Close' in result.columns:
-                result.rename(columns={'Close': 'close'}, inplace=True)
-
-            if '最高' in result.columns:
-                result.rename(columns={'最高': 'high'}, inplace=True)
-            elif 'high' not in result.columns and 'High' in result.columns:
-                result.rename(columns={'High': 'high'}, inplace=True)
-
-            if '最低' in result.columns:
-                result.rename(columns={'最低': 'low'}, inplace=True)
-            elif 'low' not in result.columns and 'Low' in result.columns:
-                result.rename(columns={'Low': 'low'}, inplace=True)
-
-            if '日期' in result.columns:
-                result['日期'] = pd.to_datetime(result['日期'])
-                result.set_index('日期', inplace=True)
-            elif 'date' in result.columns:
-                result['date'] = pd.to_datetime(result['date'])
-                result.set_index('date', inplace=True)
-            result.index.name = None
-            result['close'] = pd.to_numeric(result['close'], errors='coerce')
-            if 'high' in result.columns:
-                result['high'] = pd.to_numeric(result['high'], errors='coerce')
-            if 'low' in result.columns:
-                result['low'] = pd.to_numeric(result['low'], errors='coerce')
-            if 'close' not in result.columns: # Removed 'high' and 'low' from this critical check
-                analysis_report.append({**item_info, 'status': '🟡 数据列缺失', 'technical_indicators_summary': ["获取到的历史数据缺少必要的'close'列。"]})
-                continue
-            if len(result) < 60:
-                analysis_report.append({**item_info, 'status': '🟡 数据不足 (少于60天)', 'technical_indicators_summary': ["历史数据不足60天，部分长期指标无法计算。"], 'raw_debug_data': {}})
-                continue
-            if result['close'].isnull().all():
-                analysis_report.append({**item_info, 'status': '🟡 数据计算失败', 'technical_indicators_summary': ["'close' 列数据全为空值，无法计算指标。"]})
-                continue
-
-            result.ta.sma(close='close', length=5, append=True)
-            result.ta.sma(close='close', length=10, append=True)
-            result.ta.sma(close='close', length=20, append=True)
-            result.ta.sma(close='close', length=60, append=True)
-            result.ta.macd(close='close', append=True)
-            result.ta.bbands(close='close', length=20, append=True)
-
-            if len(result) < 2:
-                analysis_report.append({**item_info, 'status': '🟡 数据不足 (少于2天)', 'technical_indicators_summary': ["历史数据不足2天，无法进行趋势分析。"], 'raw_debug_data': {}})
-                continue
-            latest = result.iloc[-1]
-            prev_latest = result.iloc[-2]
-            trend_signals = []
-
-            analyze_ma(result, latest, prev_latest, trend_signals)
-            analyze_macd(result, latest, prev_latest, trend_signals)
-            analyze_bollinger(result, latest, prev_latest, trend_signals)
-
-
-            # --- 状态判定 ---
-            status = judge_trend_status(latest, prev_latest)
-            analysis_report.append({
-                **item_info,
-                'status': status,
-                'technical_indicators_summary': trend_signals,
-                'raw_debug_data': {}
-            })
+            if isinstance(result, Exception):
+                raise result
+            return await _compute_indicators_and_signals(result, item_info, debug)
         except Exception as e:
             logger.error(f"分析 {item_info.get('name', item_info['code'])} 时出错: {e}", exc_info=True)
-            analysis_report.append({
-                **item_info,
-                'status': '❌ 分析失败',
-                'technical_indicators_summary': [f"数据获取或分析过程中出现错误：{e}"],
-                'raw_debug_data': {}
-            })
+            return _trend_record(item_info, '❌ 分析失败', [f"数据获取或分析过程中出现错误：{e}"], debug)
+
+    positions_by_code = {}
+    for i, item_info in enumerate(core_pool):
+        positions_by_code.setdefault(item_info['code'], []).append(i)
+    # 每获取到一个标的的日线数据就立即启动其指标计算，使计算与其余标的的网络请求重叠进行
+    tasks = [None] * len(core_pool)
+    async for code, result in iter_daily_histories(get_daily_history_func, positions_by_code):
+        for i in positions_by_code[code]:
+            tasks[i] = asyncio.create_task(_analyze_one(core_pool[i], result))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    analysis_report = []
+    for item_info, res in zip(core_pool, results):
+        if isinstance(res, Exception):
+            logger.error(f"分析 {item_info.get('name', item_info['code'])} 时出错: {res}")
+            res = _trend_record(item_info, '❌ 分析失败', [f"数据获取或分析过程中出现错误：{res}"], debug)
+        analysis_report.append(res)
     return analysis_report
 
+# 盘中信号只用到实时行情中的这几列
+_SIGNAL_COLUMNS = ['代码', '最新价', '涨跌幅']
+
 class _IntradaySignalGenerator:
     def __init__(self, item_list, item_type):
         self.item_list = item_list
         self.item_type = item_type
+        # 核心观察池的代码数组与名称映射在 ak_utils 加载时已预先计算
+        if item_list is CORE_ETF_POOL:
+            self.codes, self.names_by_code = CORE_ETF_CODES, CORE_ETF_NAMES_BY_CODE
+        elif item_list is CORE_STOCK_POOL:
+            self.codes, self.names_by_code = CORE_STOCK_CODES, CORE_STOCK_NAMES_BY_CODE
+        else:
+            self.codes, self.names_by_code = index_pool(item_list)
 
     def generate_signals(self, all_item_data_df):
-        results = []
-        for item in self.item_list:
-            item_data_row = all_item_data_df[all_item_data_df['代码'] == item['code']]
-            if not item_data_row.empty:
-                current_data = item_data_row.iloc[0]
-                results.append(self._create_signal_dict(current_data, item))
-        return results
-
-    def _create_signal_dict(self, item_series, item_info):
-        points = []
-        code = item_series.get('代码')
-        raw_change = item_series.get('涨跌幅', 0)
+        # 实时行情已在 ak_utils 中按代码建立索引，一次性取出观察池中的行及用到的列，再对整个观察池向量化判定盘中信号
+        pool_df = all_item_data_df.reindex(index=self.codes, columns=_SIGNAL_COLUMNS).dropna(subset=['代码'])
+        prices = pool_df['最新价'].to_numpy(dtype=np.float64)
+        changes = pool_df['涨跌幅'].to_numpy(dtype=np.float64)
         if self.item_type == "stock":
-            change = raw_change * 100
-        else:
-            change = raw_change
-        if change > 2.5: points.append("日内大幅上涨")
-        if change < -2.5: points.append("日内大幅下跌")
-        return {
-            'code': code,
-            'name': item_info.get('name'),
-            'price': item_series.get('最新价'),
-            'change': change,
-            'analysis_points': points if points else ["盘中信号平稳"]
-        }
+            changes = changes * 100
+        points = np.select([changes > 2.5, changes < -2.5], ["日内大幅上涨", "日内大幅下跌"], default="盘中信号平稳")
+        return [
+            {
+                'code': code,
+                'name': self.names_by_code[code],
+                'price': price,
+                'change': change,
+                'analysis_points': [point]
+            }
+            for code, price, change, point in zip(pool_df.index, prices.tolist(), changes.tolist(), points.tolist())
+        ]
 
 
 async def get_detailed_analysis_report_for_debug(get_realtime_data_func, get_daily_history_func, core_pool):
     logger.info("启动AI驱动的调试分析引擎，不调用LLM...")
-    realtime_data_df_task = asyncio.to_thread(get_realtime_data_func)
-    daily_trends_task = _get_daily_trends_generic(get_daily_history_func, core_pool)
+    realtime_data_df_task = fetch_spot_realtime(get_realtime_data_func)
+    daily_trends_task = _get_daily_trends_generic(get_daily_history_func, core_pool, debug=True)
     realtime_data_df, daily_trends_list = await asyncio.gather(realtime_data_df_task, daily_trends_task)
     if realtime_data_df is None:
         return [{"name": "错误", "code": "", "ai_comment": "获取实时数据失败，无法分析。"}]
@@ -184,9 +331,6 @@ async def get_detailed_analysis_report_for_debug(get_realtime_data_func, get_dai
         name = signal['name']
         logger.info(f"正在准备调试报告: {name} ({i+1}/{len(intraday_signals)})")
         daily_trend_info = daily_trends_map.get(code, {'status': '未知', 'technical_indicators_summary': [], 'raw_debug_data': {}})
-        raw_debug_data = daily_trend_info.get('raw_debug_data', {})
-        if not raw_debug_data:
-            raw_debug_data = {}
         debug_report.append({
             'code': code,
             'name': name,
@@ -195,7 +339,6 @@ async def get_detailed_analysis_report_for_debug(get_realtime_data_func, get_dai
             'intraday_signals': signal.get('analysis_points'),
             'daily_trend_status': daily_trend_info.get('status'),
             'technical_indicators_summary': daily_trend_info.get('technical_indicators_summary'),
-            'raw_debug_data': raw_debug_data
+            'raw_debug_data': daily_trend_info.get('raw_debug_data', {})
         })
-        await asyncio.sleep(random.uniform(0.5, 1.0))
     return debug_report
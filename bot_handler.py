@@ -1,34 +1,117 @@
 from telegram import Update
 from telegram.ext import CommandHandler, ContextTypes
 import logging
+from bisect import bisect_right
+from itertools import accumulate
+from cachetools import TTLCache
 from analysis import generate_ai_driven_report,get_detailed_analysis_report_for_debug
+from rate_limiter import TokenBucket
 from ak_utils import CORE_ETF_POOL, CORE_STOCK_POOL, get_all_etf_spot_realtime, get_etf_daily_history, get_all_stock_spot_realtime, get_stock_daily_history
 
 logger = logging.getLogger(__name__)
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Telegram 建议同一会话每秒不超过1条消息，按会话分别限流，避免长报告连续发送时触发429
+# 令牌桶只在连续发送期间有意义，空闲会话的桶过期后移除，避免会话数增长导致内存持续占用
+_chat_buckets = TTLCache(maxsize=1024, ttl=600)
+
+def _chat_bucket(chat_id) -> TokenBucket:
+    """返回会话对应的令牌桶，不存在或已过期时新建"""
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        bucket = _chat_buckets[chat_id] = TokenBucket(1.0)
+    return bucket
 
 # --- 消息发送辅助函数 (已简化) ---
-async def send_long_message(update: Update, text: str):
-    """发送长消息，自动分割，纯文本模式。"""
-    if len(text) <= 4096:
-        await update.message.reply_text(text)
+def _telegram_length(text: str) -> int:
+    """Telegram按UTF-16码元计算消息长度（emoji等占2个码元），本模块所有长度限制均以此为准"""
+    return len(text.encode('utf-16-le')) // 2
+
+def _split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """在原字符串上按下标前移，尽量在换行处切分为UTF-16长度不超过 limit 的片段，不反复复制剩余文本"""
+    n = len(text)
+    if _telegram_length(text) <= limit:
+        if n:
+            yield text
         return
+    # units[k] 为 text[:k] 的UTF-16长度，用于把码元上限换算为字符下标
+    units = [0, *accumulate(1 if ord(ch) < 0x10000 else 2 for ch in text)]
+    i = 0
+    while i < n:
+        end = bisect_right(units, units[i] + limit) - 1
+        if end >= n:
+            yield text[i:]
+            return
+        j = text.rfind('\n', i, end)
+        if j <= i:
+            j = end
+        yield text[i:j]
+        # 跳过片段之间的空白，与原先 lstrip 的效果一致
+        while j < n and text[j].isspace():
+            j += 1
+        i = j
 
-    parts = []
-    while len(text) > 0:
-        if len(text) > 4096:
-            split_pos = text[:4096].rfind('\n')
-            if split_pos == -1:
-                split_pos = 4096
-            
-            parts.append(text[:split_pos])
-            text = text[split_pos:].lstrip()
-        else:
-            parts.append(text)
-            break
-            
-    for part in parts:
+async def send_long_message(update: Update, text: str):
+    """发送长消息，自动分割，纯文本模式。"""
+    bucket = _chat_bucket(update.message.chat_id)
+    for part in _split_message(text):
+        await bucket.wait()
         await update.message.reply_text(part)
 
+async def send_report(update: Update, blocks: list):
+    """按条目边界把报告各段打包为不超过4096的消息依次发送，避免在条目中间断开"""
+    chunks, current, current_len = [], [], 0
+    for block in blocks:
+        block_len = _telegram_length(block)
+        if current and current_len + block_len > TELEGRAM_MESSAGE_LIMIT:
+            chunks.append("".join(current))
+            current, current_len = [], 0
+        current.append(block)
+        current_len += block_len
+    if current:
+        chunks.append("".join(current))
+    for chunk in chunks:
+        # 单个条目本身超长时仍交由 send_long_message 按行分割
+        await send_long_message(update, chunk.rstrip())
+
+def _progress_reporter(status_message, title: str):
+    """返回把LLM分析进度更新到状态消息上的异步回调"""
+    async def _report(done: int, total: int):
+        # 编辑消息与发送消息共用同一会话的限流
+        await _chat_bucket(status_message.chat_id).wait()
+        await status_message.edit_text(f"{title}\nAI分析进度：{done}/{total} 批")
+    return _report
+
+# --- 报告文本构建 ---
+def _format_ai_report(message_header: str, report_data: list) -> list:
+    """构建AI分析报告，返回标题与各条目的文本段"""
+    parts = [message_header]
+    for i, item in enumerate(report_data, 1):
+        ai_comment = item.get('ai_comment')
+        if ai_comment is None:
+            ai_comment = "无"
+        parts.append(
+            f"🏅 #{i} {item.get('name')} ({item.get('code')})\n"
+            f"  - AI评分: {item.get('ai_score', 'N/A')} / 100\n"
+            f"  - AI点评: {ai_comment}\n\n"
+        )
+    return parts
+
+def _format_debug_report(message_header: str, report_data: list) -> list:
+    """构建调试分析报告，返回标题与各条目的文本段"""
+    parts = [message_header]
+    for i, item in enumerate(report_data, 1):
+        tech_summary = "\n    ".join(item.get('technical_indicators_summary', []))
+        intraday = ", ".join(item.get('intraday_signals', []))
+        parts.append(
+            f"#{i} {item.get('name')} ({item.get('code')})\n"
+            f"  - 最新价: {item.get('price', 'N/A')}\n"
+            f"  - 涨跌幅: {item.get('change', 'N/A')}\n"
+            f"  - 盘中信号: {intraday}\n"
+            f"  - 日线趋势: {item.get('daily_trend_status', '未知')}\n"
+            f"  - 技术指标摘要:\n    {tech_summary}\n\n"
+        )
+    return parts
+
 # --- 命令处理器 ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """欢迎信息"""
@@ -45,130 +128,62 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(welcome_text)
 
-async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """执行全面的ETF AI分析"""
-    logger.info("收到 /analyze 命令，启动ETF AI分析...")
-    await update.message.reply_text("好的，正在为您启动ETF分析引擎...")
-    
+async def _run_ai_analysis(update: Update, label: str, message_header: str,
+                           realtime_func, daily_func, core_pool):
+    """执行AI分析并回复报告，ETF与股票命令共用"""
+    start_text = f"好的，正在为您启动{label}分析引擎..."
+    status_message = await update.message.reply_text(start_text)
+
     report_data = await generate_ai_driven_report(
-        get_realtime_data_func=get_all_etf_spot_realtime,
-        get_daily_history_func=get_etf_daily_history,
-        core_pool=CORE_ETF_POOL
+        get_realtime_data_func=realtime_func,
+        get_daily_history_func=daily_func,
+        core_pool=core_pool,
+        on_progress=_progress_reporter(status_message, start_text)
     )
-    
+
     if not report_data:
-        await update.message.reply_text("未能生成ETF AI分析报告，请稍后再试。")
+        await update.message.reply_text(f"未能生成{label} AI分析报告，请稍后再试。")
         return
+    await send_report(update, _format_ai_report(message_header, report_data))
 
-    message_header = "🤖 核心ETF池AI分析报告\n(按AI综合评分排序)\n--------------------------\n\n"
-    message_body = ""
-    for i, item in enumerate(report_data, 1):
-        ai_comment = item.get('ai_comment')
-        if ai_comment is None:
-            ai_comment = "无"
+async def _run_debug_analysis(update: Update, label: str, realtime_func, daily_func, core_pool):
+    """执行调试分析（仅量化，不调用AI）并回复报告，ETF与股票命令共用"""
+    await update.message.reply_text(f"正在生成{label}调试分析报告（仅量化，不调用AI）...")
 
-        message_body += (
-            f"🏅 #{i} {item.get('name')} ({item.get('code')})\n"
-            f"  - AI评分: {item.get('ai_score', 'N/A')} / 100\n"
-            f"  - AI点评: {ai_comment}\n\n"
-        )
-    
-    final_message = message_header + message_body
-    await send_long_message(update, final_message)
+    report_data = await get_detailed_analysis_report_for_debug(
+        get_realtime_data_func=realtime_func,
+        get_daily_history_func=daily_func,
+        core_pool=core_pool
+    )
+
+    if not report_data:
+        await update.message.reply_text(f"未能生成{label}调试报告，请稍后再试。")
+        return
+    message_header = f"🛠 {label}调试分析报告（仅量化）\n--------------------------\n\n"
+    await send_report(update, _format_debug_report(message_header, report_data))
+
+async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """执行全面的ETF AI分析"""
+    logger.info("收到 /analyze 命令，启动ETF AI分析...")
+    await _run_ai_analysis(update, "ETF", "🤖 核心ETF池AI分析报告\n(按AI综合评分排序)\n--------------------------\n\n",
+                           get_all_etf_spot_realtime, get_etf_daily_history, CORE_ETF_POOL)
 
 async def analyze_stocks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """执行全面的股票AI分析"""
     logger.info("收到 /analyze_stocks 命令，启动股票AI分析...")
-    await update.message.reply_text("好的，正在为您启动股票分析引擎...")
-    
-    report_data = await generate_ai_driven_report(
-        get_realtime_data_func=get_all_stock_spot_realtime,
-        get_daily_history_func=get_stock_daily_history,
-        core_pool=CORE_STOCK_POOL
-    )
-    
-    if not report_data:
-        await update.message.reply_text("未能生成股票AI分析报告，请稍后再试。")
-        return
+    await _run_ai_analysis(update, "股票", "📈 核心股票池AI分析报告\n(按AI综合评分排序)\n--------------------------\n\n",
+                           get_all_stock_spot_realtime, get_stock_daily_history, CORE_STOCK_POOL)
 
-    message_header = "📈 核心股票池AI分析报告\n(按AI综合评分排序)\n--------------------------\n\n"
-    message_body = ""
-    for i, item in enumerate(report_data, 1):
-        ai_comment = item.get('ai_comment')
-        if ai_comment is None:
-            ai_comment = "无"
-            
-        message_body += (
-            f"🏅 #{i} {item.get('name')} ({item.get('code')})\n"
-            f"  - AI评分: {item.get('ai_score', 'N/A')} / 100\n"
-            f"  - AI点评: {ai_comment}\n\n"
-        )
-    
-    final_message = message_header + message_body
-    await send_long_message(update, final_message)
-    
 async def debug_analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """ETF调试分析（仅量化，不调用AI）"""
     logger.info("收到 /debug_analyze 命令，启动ETF调试分析...")
-    await update.message.reply_text("正在生成ETF调试分析报告（仅量化，不调用AI）...")
-
-    report_data = await get_detailed_analysis_report_for_debug(
-        get_realtime_data_func=get_all_etf_spot_realtime,
-        get_daily_history_func=get_etf_daily_history,
-        core_pool=CORE_ETF_POOL
-    )
-
-    if not report_data:
-        await update.message.reply_text("未能生成ETF调试报告，请稍后再试。")
-        return
-
-    message_header = "🛠 ETF调试分析报告（仅量化）\n--------------------------\n\n"
-    message_body = ""
-    for i, item in enumerate(report_data, 1):
-        tech_summary = "\n    ".join(item.get('technical_indicators_summary', []))
-        intraday = ", ".join(item.get('intraday_signals', []))
-        message_body += (
-            f"#{i} {item.get('name')} ({item.get('code')})\n"
-            f"  - 最新价: {item.get('price', 'N/A')}\n"
-            f"  - 涨跌幅: {item.get('change', 'N/A')}\n"
-            f"  - 盘中信号: {intraday}\n"
-            f"  - 日线趋势: {item.get('daily_trend_status', '未知')}\n"
-            f"  - 技术指标摘要:\n    {tech_summary}\n\n"
-        )
-    final_message = message_header + message_body
-    await send_long_message(update, final_message)
+    await _run_debug_analysis(update, "ETF", get_all_etf_spot_realtime, get_etf_daily_history, CORE_ETF_POOL)
 
 async def debug_stocks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """股票调试分析（仅量化，不调用AI）"""
     logger.info("收到 /debug_stocks 命令，启动股票调试分析...")
-    await update.message.reply_text("正在生成股票调试分析报告（仅量化，不调用AI）...")
-
-    report_data = await get_detailed_analysis_report_for_debug(
-        get_realtime_data_func=get_all_stock_spot_realtime,
-        get_daily_history_func=get_stock_daily_history,
-        core_pool=CORE_STOCK_POOL
-    )
-
-    if not report_data:
-        await update.message.reply_text("未能生成股票调试报告，请稍后再试。")
-        return
+    await _run_debug_analysis(update, "股票", get_all_stock_spot_realtime, get_stock_daily_history, CORE_STOCK_POOL)
 
-    message_header = "🛠 股票调试分析报告（仅量化）\n--------------------------\n\n"
-    message_body = ""
-    for i, item in enumerate(report_data, 1):
-        tech_summary = "\n    ".join(item.get('technical_indicators_summary', []))
-        intraday = ", ".join(item.get('intraday_signals', []))
-        message_body += (
-            f"#{i} {item.get('name')} ({item.get('code')})\n"
-            f"  - 最新价: {item.get('price', 'N/A')}\n"
-            f"  - 涨跌幅: {item.get('change', 'N/A')}\n"
-            f"  - 盘中信号: {intraday}\n"
-            f"  - 日线趋势: {item.get('daily_trend_status', '未知')}\n"
-            f"  - 技术指标摘要:\n    {tech_summary}\n\n"
-        )
-    final_message = message_header + message_body
-    await send_long_message(update, final_message)
-    
 def setup_handlers(application):
     """设置所有命令处理器"""
     application.add_handler(CommandHandler("start", start))
@@ -1,53 +1,279 @@
+import numpy as np
 import pandas as pd
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """未安装numba时的退化装饰器，直接返回原函数"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# --- 指标计算内核 ---
+# 列名及计算口径与 pandas_ta 保持一致：SMA 为简单滑动平均，EMA 以首个完整窗口的 SMA 作为初值，布林带使用总体标准差
+
+BOLLINGER_CROSS_DAYS = 5 # 布林中轨震荡判别检查的交易日数
+SMA_LENGTHS = (5, 10, 20, 60)
+
+@njit(cache=True, nogil=True)
+def sma_tail(values, lengths, tail=2):
+    """只计算最后tail根K线上各周期的简单移动平均，返回形状为 (n, len(lengths)) 的数组，其余位置为NaN；窗口内含NaN时结果为NaN"""
+    n = values.shape[0]
+    out = np.full((n, len(lengths)), np.nan)
+    for j in range(len(lengths)):
+        length = lengths[j]
+        for i in range(max(length - 1, n - tail), n):
+            window = values[i - length + 1:i + 1]
+            if not np.isnan(window).any():
+                out[i, j] = window.sum() / length
+    return out
+
+@njit(cache=True, nogil=True)
+def ema(values, length):
+    """指数移动平均：从首个有效值起取前length个值的均值作为初值，遇到NaN时沿用上一值"""
+    n = values.shape[0]
+    out = np.full(n, np.nan)
+    start = 0
+    while start < n and np.isnan(values[start]):
+        start += 1
+    seed_end = start + length - 1
+    if seed_end >= n:
+        return out
+    alpha = 2.0 / (length + 1)
+    prev = np.nanmean(values[start:seed_end + 1])
+    out[seed_end] = prev
+    for i in range(seed_end + 1, n):
+        if not np.isnan(values[i]):
+            prev = alpha * values[i] + (1.0 - alpha) * prev
+        out[i] = prev
+    return out
+
+@njit(cache=True, nogil=True)
+def macd(close, fast=12, slow=26, signal=9):
+    """返回 (MACD线, 信号线, 柱线)"""
+    macd_line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(macd_line, signal)
+    return macd_line, signal_line, macd_line - signal_line
+
+@njit(cache=True, nogil=True)
+def bbands_tail(close, length=20, std=2.0, tail=BOLLINGER_CROSS_DAYS):
+    """只计算最后tail根K线的布林通道 (下轨, 中轨, 上轨)，其余位置为NaN；窗口内含NaN时结果为NaN"""
+    n = close.shape[0]
+    lower = np.full(n, np.nan)
+    middle = np.full(n, np.nan)
+    upper = np.full(n, np.nan)
+    for i in range(max(length - 1, n - tail), n):
+        window = close[i - length + 1:i + 1]
+        if np.isnan(window).any():
+            continue
+        mean = window.mean()
+        deviation = std * np.sqrt(((window - mean) ** 2).mean())
+        lower[i] = mean - deviation
+        middle[i] = mean
+        upper[i] = mean + deviation
+    return lower, middle, upper
+
+# --- 数值判定内核 ---
+# 内核只接收浮点数/数组并返回整数状态码，状态码再通过下方的元组查表转换为信号文本
+
+@njit(cache=True)
+def _cross_code(fast_now, slow_now, fast_prev, slow_prev):
+    """0: 数据缺失, 1: 金叉, 2: 死叉, 3: 快线在上方延续, 4: 快线在下方延续"""
+    if np.isnan(fast_now) or np.isnan(slow_now) or np.isnan(fast_prev) or np.isnan(slow_prev):
+        return 0
+    if fast_now > slow_now and fast_prev <= slow_prev:
+        return 1
+    if fast_now < slow_now and fast_prev >= slow_prev:
+        return 2
+    return 3 if fast_now > slow_now else 4
+
+@njit(cache=True)
+def _slope_code(now, prev):
+    """0: 数据缺失, 1: 向上, 2: 向下, 3: 持平"""
+    if np.isnan(now) or np.isnan(prev):
+        return 0
+    if now > prev:
+        return 1
+    if now < prev:
+        return 2
+    return 3
+
+@njit(cache=True)
+def _zero_axis_code(value):
+    """1: 零轴上方, 2: 零轴下方, 3: 零轴附近"""
+    if value > 0:
+        return 1
+    if value < 0:
+        return 2
+    return 3
+
+@njit(cache=True)
+def _macd_hist_code(hist_now, hist_prev):
+    """1-3: 红柱增长/缩短/持平, 4-6: 绿柱增长/缩短/持平, 7: 柱线在零轴"""
+    if hist_now > 0:
+        if hist_now > hist_prev:
+            return 1
+        if hist_now < hist_prev:
+            return 2
+        return 3
+    if hist_now < 0:
+        if hist_now < hist_prev: # Histogram becomes more negative
+            return 4
+        if hist_now > hist_prev: # Histogram becomes less negative (moves towards zero)
+            return 5
+        return 6
+    return 7
+
+@njit(cache=True)
+def _bollinger_position_code(close, upper, middle, lower):
+    """0: 无信号(恰好位于中轨), 1: 突破上轨, 2: 跌破下轨, 3: 中轨之上, 4: 中轨之下"""
+    if close > upper:
+        return 1
+    if close < lower:
+        return 2
+    if close > middle:
+        return 3
+    if close < middle:
+        return 4
+    return 0
+
+@njit(cache=True)
+def _count_middle_crosses(closes, middles):
+    """统计相邻交易日之间收盘价穿越布林中轨的次数，含NaN的交易日对跳过"""
+    cross_count = 0
+    for i in range(1, closes.shape[0]):
+        current_close = closes[i]
+        current_middle = middles[i]
+        prev_close = closes[i - 1]
+        prev_middle = middles[i - 1]
+        if np.isnan(current_close) or np.isnan(current_middle) or np.isnan(prev_close) or np.isnan(prev_middle):
+            continue
+        # A cross occurs if the relationship (close > middle) changes from previous day to current day
+        if (prev_close <= prev_middle and current_close > current_middle) or \
+           (prev_close >= prev_middle and current_close < current_middle):
+            cross_count += 1
+    return cross_count
+
+def _warm_up_kernels():
+    """以与实际调用相同的参数类型调用一次各内核，使JIT编译（或从磁盘缓存加载）发生在模块导入时而非首个请求中"""
+    sample = np.linspace(1.0, 2.0, 64)
+    sma_tail(sample, SMA_LENGTHS, 2)
+    macd(sample, 12, 26, 9)
+    bbands_tail(sample, 20, 2.0, BOLLINGER_CROSS_DAYS)
+    _cross_code(1.0, 1.0, 1.0, 1.0)
+    _slope_code(1.0, 1.0)
+    _zero_axis_code(1.0)
+    _macd_hist_code(1.0, 1.0)
+    _bollinger_position_code(1.0, 1.0, 1.0, 1.0)
+    _count_middle_crosses(sample, sample)
+
+_warm_up_kernels()
+
+# --- 状态码对应的信号文本 ---
+_MA_PRICE_TEMPLATES = ("{}日均线数据缺失。", "股价高于{}日均线。", "股价低于{}日均线。")
+_MA_CROSS_TEMPLATES = (
+    "{}日与{}日均线数据缺失，无法判断交叉。",
+    "{}日均线金叉{}日均线（看涨信号）。",
+    "{}日均线死叉{}日均线（看跌信号）。",
+    "{}日均线在{}日均线上方，多头排列延续。",
+    "{}日均线在{}日均线下方，空头排列延续。",
+)
+# 按均线周期预先展开的完整信号文本，分析时只需按状态码查表
+_MA_CROSS_PAIRS = ((0, 1), (1, 2), (2, 3)) # (5, 10), (10, 20), (20, 60)
+_MA_PRICE_SIGNALS = tuple(
+    tuple(template.format(length) for template in _MA_PRICE_TEMPLATES) for length in SMA_LENGTHS
+)
+_MA_CROSS_SIGNALS = tuple(
+    tuple(template.format(SMA_LENGTHS[s_i], SMA_LENGTHS[l_i]) for template in _MA_CROSS_TEMPLATES)
+    for s_i, l_i in _MA_CROSS_PAIRS
+)
+_MA_COLUMNS = [f'SMA_{length}' for length in SMA_LENGTHS]
+_MA_CROSS_FAST = np.array([s_i for s_i, _ in _MA_CROSS_PAIRS])
+_MA_CROSS_SLOW = np.array([l_i for _, l_i in _MA_CROSS_PAIRS])
+
+def _ma_state_codes(close, ma_now, ma_prev):
+    """
+    一次数组比较得到全部均线的状态码
+    价格与均线: 0 均线缺失, 1 价格高于均线, 2 价格不高于均线
+    均线交叉: 与 _cross_code 相同
+    """
+    price_codes = np.where(np.isnan(ma_now), 0, np.where(close > ma_now, 1, 2))
+    fast_now, slow_now = ma_now[_MA_CROSS_FAST], ma_now[_MA_CROSS_SLOW]
+    fast_prev, slow_prev = ma_prev[_MA_CROSS_FAST], ma_prev[_MA_CROSS_SLOW]
+    missing = np.isnan(fast_now) | np.isnan(slow_now) | np.isnan(fast_prev) | np.isnan(slow_prev)
+    cross_codes = np.select(
+        [missing, (fast_now > slow_now) & (fast_prev <= slow_prev), (fast_now < slow_now) & (fast_prev >= slow_prev), fast_now > slow_now],
+        [0, 1, 2, 3],
+        default=4,
+    )
+    return price_codes.tolist(), cross_codes.tolist()
+_MA60_SLOPE_SIGNALS = (
+    "60日均线数据缺失，无法判断趋势。",
+    "60日均线趋势向上（中长期趋势积极）。",
+    "60日均线趋势向下（中长期趋势谨慎）。",
+    "60日均线趋势持平（中长期趋势中性）。",
+)
+_MACD_CROSS_SIGNALS = (
+    None,
+    "MACD金叉（看涨信号）。",
+    "MACD死叉（看跌信号）。",
+    "MACD线在信号线上方，多头延续。",
+    "MACD线在信号线下方，空头延续。",
+)
+_MACD_ZERO_AXIS_SIGNALS = (
+    None,
+    "MACD线在零轴上方，市场偏强。",
+    "MACD线在零轴下方，市场偏弱。",
+    "MACD线在零轴附近，市场中性。",
+)
+_MACD_HIST_SIGNALS = (
+    None,
+    "MACD红柱增长，多头力量增强。",
+    "MACD红柱缩短，多头力量减弱。",
+    "MACD红柱持平，多头力量维持。",
+    "MACD绿柱增长，空头力量增强。",
+    "MACD绿柱缩短，空头力量减弱。",
+    "MACD绿柱持平，空头力量维持。",
+    "MACD柱线在零轴，多空平衡。",
+)
+_BOLLINGER_POSITION_SIGNALS = (
+    None,
+    "收盘价突破布林上轨，短线超买，警惕回调。",
+    "收盘价跌破布林下轨，短线超卖，关注反弹。",
+    "收盘价位于布林中轨之上，趋势偏强。",
+    "收盘价位于布林中轨之下，趋势偏弱。",
+)
+
+def _row_values(result, row, cols):
+    """按列位置一次性取出一行（与 result.columns 对齐的numpy数组或Series）中的多个浮点值，列不存在或值缺失时记为NaN"""
+    values = np.asarray(row)
+    positions = result.columns.get_indexer(cols)
+    if values.dtype.kind != 'f':
+        # 含非数值列时行数组为object类型，逐个转换
+        return [
+            float(values[i]) if i >= 0 and pd.notna(values[i]) else np.nan
+            for i in positions
+        ]
+    picked = values[positions].astype(np.float64)
+    picked[positions < 0] = np.nan
+    return picked.tolist()
 
 def analyze_bollinger(result, latest, prev_latest, trend_signals):
     try:
-        upper = latest.get('BBU_20_2.0')
-        middle = latest.get('BBM_20_2.0')
-        lower = latest.get('BBL_20_2.0')
-        close = latest.get('close') # Corrected: using 'close'
-        
+        upper, middle, lower, close = _row_values(result, latest, ['BBU_20_2.0', 'BBM_20_2.0', 'BBL_20_2.0', 'close'])
+
         # Ensure all necessary Bollinger Band values and close price are not NaN
-        if pd.notna(upper) and pd.notna(middle) and pd.notna(lower) and pd.notna(close): 
-            if close > upper:
-                trend_signals.append("收盘价突破布林上轨，短线超买，警惕回调。")
-            elif close < lower:
-                trend_signals.append("收盘价跌破布林下轨，短线超卖，关注反弹。")
-            elif close > middle:
-                trend_signals.append("收盘价位于布林中轨之上，趋势偏强。")
-            elif close < middle:
-                trend_signals.append("收盘价位于布林中轨之下，趋势偏弱。")
-            
-            # 震荡判别：检查最近几个交易日穿越布林中轨的次数
-            # 修正：避免直接比较 Series 对象，而是检查每日穿越情况
-            # 需要至少两个数据点来判断交叉
+        if not np.isnan([upper, middle, lower, close]).any():
+            position_signal = _BOLLINGER_POSITION_SIGNALS[_bollinger_position_code(close, upper, middle, lower)]
+            if position_signal:
+                trend_signals.append(position_signal)
+
+            # 震荡判别：检查最近5个交易日内收盘价穿越布林中轨的次数
             if len(result) >= 2 and 'close' in result.columns and 'BBM_20_2.0' in result.columns:
-                cross_count = 0
-                # 检查最近 N 天的穿越，例如最近 5 个交易日
-                # 需要至少 6 个数据点才能检查到 5 次"前一天"和"当前天"
-                # 更稳健的做法是获取最近的完整数据段
-                num_days_to_check = min(len(result), 5) # Check up to the last 5 days available
-                
-                # Iterate from the second-to-last day back to check for crosses
-                for i in range(1, num_days_to_check):
-                    current_idx = -1 - (num_days_to_check - 1 - i) # Current day index (from tail)
-                    prev_idx = current_idx - 1 # Previous day index (from tail)
-
-                    current_close = result['close'].iloc[current_idx]
-                    current_middle = result['BBM_20_2.0'].iloc[current_idx]
-                    prev_close = result['close'].iloc[prev_idx]
-                    prev_middle = result['BBM_20_2.0'].iloc[prev_idx]
-
-                    if pd.notna(current_close) and pd.notna(current_middle) and \
-                       pd.notna(prev_close) and pd.notna(prev_middle):
-                        
-                        # A cross occurs if the relationship (close > middle) changes from previous day to current day
-                        # i.e., (prev_close <= prev_middle AND current_close > current_middle) OR
-                        #       (prev_close >= prev_middle AND current_close < current_middle)
-                        if (prev_close <= prev_middle and current_close > current_middle) or \
-                           (prev_close >= prev_middle and current_close < current_middle):
-                            cross_count += 1
-                
+                num_days_to_check = min(len(result), BOLLINGER_CROSS_DAYS) # Check up to the last 5 days available
+                recent = result[['close', 'BBM_20_2.0']].to_numpy(dtype=np.float64)[-num_days_to_check:]
+                cross_count = _count_middle_crosses(recent[:, 0], recent[:, 1])
+
                 # If there are frequent crosses (e.g., 2 or more in 5 days), it indicates oscillation
                 if cross_count >= 2: # Lowering threshold slightly as 5 days is a short window
                     trend_signals.append("近期收盘价频繁上下穿布林中轨，市场震荡明显。")
@@ -59,19 +285,16 @@ def analyze_bollinger(result, latest, prev_latest, trend_signals):
         trend_signals.append(f"布林通道分析异常：{e}，跳过分析。")
 
 
-def judge_trend_status(latest, prev_latest):
+def judge_trend_status(result, latest, prev_latest):
     """
     综合均线、布林通道等，返回趋势状态字符串。
     """
     status = '🟡 震荡趋势' # Default to neutral/sideways
     
-    close = latest.get('close') # Using 'close'
+    close, sma_20, sma_60, middle_bb = _row_values(result, latest, ['close', 'SMA_20', 'SMA_60', 'BBM_20_2.0'])
     if pd.isna(close):
         return '🟡 数据异常' 
 
-    sma_20 = latest.get('SMA_20')
-    sma_60 = latest.get('SMA_60')
-
     # Primary trend based on close vs SMA_20
     if pd.notna(sma_20):
         if close > sma_20:
@@ -97,8 +320,7 @@ def judge_trend_status(latest, prev_latest):
             status = '🟡 震荡趋势' 
 
     # Bollinger Bands for confirming oscillation
-    middle_bb = latest.get('BBM_20_2.0')
-    if pd.notna(middle_bb) and pd.notna(close): # Ensure close is also available for this check
+    if pd.notna(middle_bb) and pd.notna(close) and middle_bb != 0: # Ensure close is also available for this check
         # If close price is very near the middle band, it suggests oscillation
         if abs(close - middle_bb) / middle_bb < 0.005: 
             status = '🟡 震荡趋势'
@@ -110,68 +332,20 @@ def analyze_ma(result, latest, prev_latest, trend_signals):
     均线（MA）信号分析
     """
     try:
-        close = latest.get('close') # Using 'close'
-        if pd.isna(close):
+        close, *ma_now = _row_values(result, latest, ['close'] + _MA_COLUMNS)
+        ma_prev = _row_values(result, prev_latest, _MA_COLUMNS)
+        if np.isnan(close):
             trend_signals.append("收盘价数据缺失，无法进行均线分析。")
             return
 
+        price_codes, cross_codes = _ma_state_codes(close, np.array(ma_now), np.array(ma_prev))
         # 股价与均线关系
-        for length in [5, 10, 20, 60]:
-            col = f'SMA_{length}'
-            val = latest.get(col)
-            if pd.notna(val):
-                if close > val: 
-                    trend_signals.append(f"股价高于{length}日均线。")
-                else:
-                    trend_signals.append(f"股价低于{length}日均线。")
-            else:
-                trend_signals.append(f"{length}日均线数据缺失。")
-
+        trend_signals.extend(signals[code] for signals, code in zip(_MA_PRICE_SIGNALS, price_codes))
         # 均线交叉（金叉/死叉）
-        ma_pairs = [(5, 10), (10, 20), (20, 60)]
-        for s_len, l_len in ma_pairs:
-            s_col = f'SMA_{s_len}'
-            l_col = f'SMA_{l_len}'
-            
-            # 修正：直接使用布尔表达式，避免再次包装在 all() 中
-            # 检查当前和前一日均线值是否都可用
-            current_s_val = latest.get(s_col)
-            current_l_val = latest.get(l_col)
-            prev_s_val = prev_latest.get(s_col)
-            prev_l_val = prev_latest.get(l_col)
-
-            # --- 修正后的条件判断 ---
-            if pd.notna(current_s_val) and pd.notna(current_l_val) and \
-               pd.notna(prev_s_val) and pd.notna(prev_l_val):
-                
-                # Check for Golden Cross
-                if current_s_val > current_l_val and prev_s_val <= prev_l_val:
-                    trend_signals.append(f"{s_len}日均线金叉{l_len}日均线（看涨信号）。")
-                # Check for Death Cross
-                elif current_s_val < current_l_val and prev_s_val >= prev_l_val:
-                    trend_signals.append(f"{s_len}日均线死叉{l_len}日均线（看跌信号）。")
-                else:
-                    # Current arrangement description if no cross
-                    if current_s_val > current_l_val:
-                        trend_signals.append(f"{s_len}日均线在{l_len}日均线上方，多头排列延续。")
-                    else:
-                        trend_signals.append(f"{s_len}日均线在{l_len}日均线下方，空头排列延续。")
-            else:
-                trend_signals.append(f"{s_len}日与{l_len}日均线数据缺失，无法判断交叉。")
-        
+        trend_signals.extend(signals[code] for signals, code in zip(_MA_CROSS_SIGNALS, cross_codes))
+
         # 60日均线趋势 (Long-term trend)
-        sma_60_latest = latest.get('SMA_60')
-        sma_60_prev = prev_latest.get('SMA_60')
-
-        if pd.notna(sma_60_latest) and pd.notna(sma_60_prev):
-            if sma_60_latest > sma_60_prev:
-                trend_signals.append("60日均线趋势向上（中长期趋势积极）。")
-            elif sma_60_latest < sma_60_prev:
-                trend_signals.append("60日均线趋势向下（中长期趋势谨慎）。")
-            else:
-                trend_signals.append("60日均线趋势持平（中长期趋势中性）。")
-        else:
-            trend_signals.append("60日均线数据缺失，无法判断趋势。")
+        trend_signals.append(_MA60_SLOPE_SIGNALS[_slope_code(ma_now[3], ma_prev[3])])
     except Exception as e: 
         trend_signals.append(f"均线分析异常：{e}，跳过分析。")
 
@@ -180,56 +354,19 @@ def analyze_macd(result, latest, prev_latest, trend_signals):
     MACD信号分析
     """
     try:
-        macd_line_col = 'MACD_12_26_9'
-        signal_line_col = 'MACDs_12_26_9'
-        histogram_col = 'MACDh_12_26_9'
-        
-        l_macd = latest.get(macd_line_col)
-        l_signal = latest.get(signal_line_col)
-        l_hist = latest.get(histogram_col)
-        p_macd = prev_latest.get(macd_line_col)
-        p_signal = prev_latest.get(signal_line_col)
-        p_hist = prev_latest.get(histogram_col)
-        
+        macd_cols = ['MACD_12_26_9', 'MACDs_12_26_9', 'MACDh_12_26_9'] # MACD线、信号线、柱线
+        l_macd, l_signal, l_hist = _row_values(result, latest, macd_cols)
+        p_macd, p_signal, p_hist = _row_values(result, prev_latest, macd_cols)
+
         # Check if all necessary MACD values are not NaN before proceeding
-        if all(pd.notna(x) for x in [l_macd, l_signal, l_hist, p_macd, p_signal, p_hist]):
+        if not np.isnan([l_macd, l_signal, l_hist, p_macd, p_signal, p_hist]).any():
             # 金叉/死叉
-            if l_macd > l_signal and p_macd <= p_signal:
-                trend_signals.append("MACD金叉（看涨信号）。")
-            elif l_macd < l_signal and p_macd >= p_signal:
-                trend_signals.append("MACD死叉（看跌信号）。")
-            else:
-                if l_macd > l_signal:
-                    trend_signals.append("MACD线在信号线上方，多头延续。")
-                else:
-                    trend_signals.append("MACD线在信号线下方，空头延续。")
-            
+            trend_signals.append(_MACD_CROSS_SIGNALS[_cross_code(l_macd, l_signal, p_macd, p_signal)])
             # 零轴
-            if l_macd > 0:
-                trend_signals.append("MACD线在零轴上方，市场偏强。")
-            elif l_macd < 0:
-                trend_signals.append("MACD线在零轴下方，市场偏弱。")
-            else:
-                trend_signals.append("MACD线在零轴附近，市场中性。")
-            
+            trend_signals.append(_MACD_ZERO_AXIS_SIGNALS[_zero_axis_code(l_macd)])
             # 柱线变化
-            if l_hist > 0: # Red bars (positive histogram)
-                if l_hist > p_hist:
-                    trend_signals.append("MACD红柱增长，多头力量增强。")
-                elif l_hist < p_hist:
-                    trend_signals.append("MACD红柱缩短，多头力量减弱。")
-                else:
-                    trend_signals.append("MACD红柱持平，多头力量维持。")
-            elif l_hist < 0: # Green bars (negative histogram)
-                if l_hist < p_hist: # Histogram becomes more negative
-                    trend_signals.append("MACD绿柱增长，空头力量增强。")
-                elif l_hist > p_hist: # Histogram becomes less negative (moves towards zero)
-                    trend_signals.append("MACD绿柱缩短，空头力量减弱。")
-                else:
-                    trend_signals.append("MACD绿柱持平，空头力量维持。")
-            else: # Histogram is zero
-                trend_signals.append("MACD柱线在零轴，多空平衡。")
+            trend_signals.append(_MACD_HIST_SIGNALS[_macd_hist_code(l_hist, p_hist)])
         else:
             trend_signals.append("MACD指标数据缺失或不完整，无法分析。")
     except Exception as e: 
-        trend_signals.append(f"MACD分析异常：{e}，跳过分析。")
\ No newline at end of file
+        trend_signals.append(f"MACD分析异常：{e}，跳过分析。")
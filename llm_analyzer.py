@@ -3,27 +3,117 @@
 import os
 import json
 import logging
-import asyncio
-from openai import OpenAI
+import hashlib
+from datetime import datetime
+from diskcache import Cache
+from openai import AsyncOpenAI
+from rate_limiter import TokenBucket
+from ak_utils import SHANGHAI_TZ
 
 logger = logging.getLogger(__name__)
 
 # --- 配置 ---
+# 限流(429)、连接错误及5xx时的最大重试次数，由SDK按指数退避（并遵循 Retry-After）自动重试
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '4'))
 try:
-    client = OpenAI(
+    # 进程内共享一个异步客户端，所有请求复用其 HTTP 连接池
+    client = AsyncOpenAI(
         base_url=os.getenv("LLM_API_BASE"),
         api_key=os.getenv("LLM_API_KEY"),
+        max_retries=LLM_MAX_RETRIES,
     )
 except Exception as e:
     logger.error(f"初始化OpenAI客户端失败，请检查.env配置: {e}")
     client = None
 
-# --- 核心函数 ---
-async def get_llm_score_and_analysis(etf_data, daily_trend_data):
-    """调用大模型对单支ETF进行分析和打分"""
-    if client is None:
-        return None, "LLM服务未配置或初始化失败。"
-        
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "sonar-pro")
+
+# 同一交易日内输入完全相同的分析请求直接复用LLM结果
+# 相对路径以脚本所在目录为基准，避免受启动时工作目录影响（缓存在导入时创建，早于 main.py 切换目录）
+LLM_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv('LLM_CACHE_DIR', '.cache/llm'))
+LLM_CACHE_EXPIRE = 24 * 3600
+llm_cache = Cache(LLM_CACHE_DIR)
+
+def _llm_cache_key(model, combined_data):
+    """以交易日（北京时间，与历史行情缓存一致）、模型名和完整输入数据的哈希作为缓存键"""
+    payload = json.dumps(combined_data, ensure_ascii=False, sort_keys=True, default=str)
+    digest = hashlib.sha256(f"{model}|{payload}".encode('utf-8')).hexdigest()
+    return f"llm:{datetime.now(SHANGHAI_TZ).date().isoformat()}:{digest}"
+
+# 每分钟最多请求LLM的次数，0表示不限制；LLM_BURST 为允许连续突发的请求数
+LLM_RPM = int(os.getenv('LLM_RPM', '0'))
+LLM_BURST = max(1, int(os.getenv('LLM_BURST', '1')))
+
+_pacer = TokenBucket(LLM_RPM / 60.0, LLM_BURST)
+
+# --- 提示词与输出格式 ---
+# 明确指示LLM如何利用 '详细技术指标分析列表'，并要求输出为一段自然语言的点评字符串
+_ANALYSIS_GUIDE = (
+    "你是一个专业的金融数据分析师。请根据用户提供的JSON数据，进行全面、客观的投资标的分析。\n"
+    "分析内容包括：\n"
+    "1. **概览**：投资标的名称、代码、日内涨跌幅。\n"
+    "2. **宏观趋势**：日线级别整体趋势。\n"
+    "3. **即时信号**：盘中技术信号（如果有）。\n"
+    "4. **详细技术面**：根据提供的'详细技术指标分析列表'，对均线、布林通道位置、MACD等进行综合分析，\n"
+    "   - **务必提及列表中的每一项指标（即使是数据缺失或中性信号），并用清晰的自然语言描述其含义**。\n"
+    "   - 例如：'股价高于20日均线，短期趋势向上；MACD金叉，多头力量增强；成交量较60日均量显著放大，市场活跃。'\n"
+    "   - **避免直接引用列表中的原句，而是整合为连贯的分析性语句**。\n"
+    "5. **综合评分和精炼点评**：\n"
+    "   - 综合上述分析，给出一个0-100分的综合评分（50为中性）。\n"
+    "   - 撰写一句精炼的交易点评（作为comment字段内容）。\n"
+    "   - **点评应是流畅的自然语言字符串，而不是嵌套的JSON或字典**。\n\n"
+)
+SYSTEM_PROMPT = _ANALYSIS_GUIDE + (
+    "请严格以JSON格式返回，包含'score'（数字类型）和'comment'（字符串类型）两个键，例如:\n"
+    '{"score": 75, "comment": "上证50ETF目前技术面表现强劲，股价站上多条均线，MACD呈金叉，但需注意量能是否持续。建议关注。"} \n'
+    "确保comment字段是**纯字符串**，不包含任何嵌套JSON结构。" # 再次强调
+)
+BATCH_SYSTEM_PROMPT = _ANALYSIS_GUIDE + (
+    "用户提供的是由多个投资标的组成的JSON数组，请对每个标的分别独立完成上述分析。\n"
+    "请严格以JSON格式返回，包含键'results'，其值为数组，每个元素对应一个标的，包含'code'（字符串类型，与输入中的代码一致）、"
+    "'score'（数字类型）和'comment'（字符串类型）三个键，例如:\n"
+    '{"results": [{"code": "510050", "score": 75, "comment": "上证50ETF目前技术面表现强劲，股价站上多条均线，MACD呈金叉。建议关注。"}]} \n'
+    "确保每个comment字段都是**纯字符串**，不包含任何嵌套JSON结构。"
+)
+_SCORE_PROPERTIES = {
+    "score": {"type": "number", "description": "0到100分的综合评分"},
+    "comment": {"type": "string", "description": "一段流畅的、总结性的自然语言交易点评"}
+}
+_SINGLE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "schema": {
+            "type": "object",
+            "properties": _SCORE_PROPERTIES,
+            "required": ["score", "comment"]
+        }
+    }
+}
+_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"code": {"type": "string", "description": "投资标的代码"}, **_SCORE_PROPERTIES},
+                        "required": ["code", "score", "comment"]
+                    }
+                }
+            },
+            "required": ["results"]
+        }
+    }
+}
+
+# 发送给LLM的数据使用紧凑JSON（无缩进和多余空格），减少输入token
+_COMPACT_SEPARATORS = (',', ':')
+
+def _build_combined_data(etf_data, daily_trend_data):
+    """将盘中信号与日线趋势扁平化为传给LLM的单个标的数据"""
     # --- 1. 修改 prompt_data 的结构 ---
     # 将所有必要的信息都扁平化，直接传递给LLM
     # LLM会看到 etf_data 和 daily_trend_data 组合在一起的完整信息
@@ -32,59 +122,48 @@ async def get_llm_score_and_analysis(etf_data, daily_trend_data):
         "代码": etf_data.get('code'),
         "日内涨跌幅": f"{etf_data.get('change', 0):.2f}%",
         "日线级别整体趋势": daily_trend_data.get('status'), # 例如 '🟢 强势上升趋势'
-        "盘中技术信号": daily_trend_data.get('intraday_signals'), # 这个daily_trend_data中没有，应该是etf_data里
+        "盘中技术信号": etf_data.get('analysis_points') or [], # 盘中信号来自 etf_data，确保始终是列表
         "详细技术指标分析列表": daily_trend_data.get('technical_indicators_summary', []) # 这是关键，传递详细的列表
     }
-    # 修正：intraday_signals应该从etf_data获取
-    if etf_data.get('analysis_points'):
-        combined_data["盘中技术信号"] = etf_data.get('analysis_points')
-    else:
-        combined_data["盘中技术信号"] = [] # 确保始终是列表
-
-    # --- 2. 优化 system_prompt ---
-    # 明确指示LLM如何利用 '详细技术指标分析列表'，并要求输出为一段自然语言的点评字符串
-    system_prompt = (
-        "你是一个专业的金融数据分析师。请根据用户提供的JSON数据，进行全面、客观的投资标的分析。\n"
-        "分析内容包括：\n"
-        "1. **概览**：投资标的名称、代码、日内涨跌幅。\n"
-        "2. **宏观趋势**：日线级别整体趋势。\n"
-        "3. **即时信号**：盘中技术信号（如果有）。\n"
-        "4. **详细技术面**：根据提供的'详细技术指标分析列表'，对均线、布林通道位置、MACD等进行综合分析，\n"
-        "   - **务必提及列表中的每一项指标（即使是数据缺失或中性信号），并用清晰的自然语言描述其含义**。\n"
-        "   - 例如：'股价高于20日均线，短期趋势向上；MACD金叉，多头力量增强；成交量较60日均量显著放大，市场活跃。'\n"
-        "   - **避免直接引用列表中的原句，而是整合为连贯的分析性语句**。\n"
-        "5. **综合评分和精炼点评**：\n"
-        "   - 综合上述分析，给出一个0-100分的综合评分（50为中性）。\n"
-        "   - 撰写一句精炼的交易点评（作为comment字段内容）。\n"
-        "   - **点评应是流畅的自然语言字符串，而不是嵌套的JSON或字典**。\n\n"
-        "请严格以JSON格式返回，包含'score'（数字类型）和'comment'（字符串类型）两个键，例如:\n"
-        '{"score": 75, "comment": "上证50ETF目前技术面表现强劲，股价站上多条均线，MACD呈金叉，但需注意量能是否持续。建议关注。"} \n'
-        "确保comment字段是**纯字符串**，不包含任何嵌套JSON结构。" # 再次强调
-    )
+    return combined_data
+
+# --- 核心函数 ---
+def _score_and_comment(result_dict):
+    """从单个标的的结果字典中取出 (score, comment)，score 不是数值时记为中性的50分"""
+    score = result_dict.get('score')
+    if not isinstance(score, (int, float)):
+        score = 50
+    return score, result_dict.get('comment')
+
+async def close_llm_client():
+    """关闭共享的LLM客户端及其连接池"""
+    if client is not None:
+        await client.close()
+
+async def get_llm_score_and_analysis(etf_data, daily_trend_data):
+    """调用大模型对单支ETF进行分析和打分"""
+    if client is None:
+        return None, "LLM服务未配置或初始化失败。"
+        
+    combined_data = _build_combined_data(etf_data, daily_trend_data)
+    model = LLM_MODEL_NAME
+    cache_key = _llm_cache_key(model, combined_data)
+    cached_result = llm_cache.get(cache_key)
+    if cached_result is not None:
+        logger.info(f"命中LLM缓存: {etf_data.get('name')}")
+        return cached_result
 
     try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model=os.getenv("LLM_MODEL_NAME", "sonar-pro"),
+        await _pacer.wait()
+        response = await client.chat.completions.create(
+            model=model,
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 # 使用 combined_data 传递给 LLM
-                {"role": "user", "content": json.dumps(combined_data, ensure_ascii=False, indent=2)} 
+                {"role": "user", "content": json.dumps(combined_data, ensure_ascii=False, separators=_COMPACT_SEPARATORS)}
             ],
             # 使用通用的 JSON 对象模式，让模型自由生成内容，再由我们解析
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "score": {"type": "number", "description": "0到100分的综合评分"},
-                            "comment": {"type": "string", "description": "一段流畅的、总结性的自然语言交易点评"}
-                        },
-                        "required": ["score", "comment"]
-                    }
-                }
-            }
+            response_format=_SINGLE_RESPONSE_FORMAT
         )
         
         raw_content = response.choices[0].message.content
@@ -92,22 +171,15 @@ async def get_llm_score_and_analysis(etf_data, daily_trend_data):
             logger.warning(f"LLM为空内容返回: {etf_data.get('name')}")
             return 50, "模型未提供有效分析。"
 
-        # 确保解析结果是字典
+        # 确保解析结果是字典（兼容模型返回单元素列表的情况）
         parsed_json = json.loads(raw_content)
-        
-        # 你的解析逻辑：确保 parsed_json 是一个字典
-        result_dict = None
         if isinstance(parsed_json, list) and parsed_json:
-            result_dict = parsed_json[0]
-        elif isinstance(parsed_json, dict):
-            result_dict = parsed_json
-
-        if result_dict and isinstance(result_dict, dict):
-            score = result_dict.get('score')
-            comment = result_dict.get('comment')
-            if not isinstance(score, (int, float)):
-                 score = 50
-            return score, comment
+            parsed_json = parsed_json[0]
+
+        if parsed_json and isinstance(parsed_json, dict):
+            result = _score_and_comment(parsed_json)
+            llm_cache.set(cache_key, result, expire=LLM_CACHE_EXPIRE)
+            return result
         else:
             logger.error(f"LLM返回格式错误，不是预期的JSON字典: {raw_content}")
             return 50, "LLM返回格式错误或内容不符合预期。"
@@ -115,3 +187,58 @@ async def get_llm_score_and_analysis(etf_data, daily_trend_data):
     except Exception as e:
         logger.error(f"调用或解析LLM响应时出错: {e}", exc_info=True)
         return 50, f"LLM分析服务异常: {e}" # 返回50分和错误信息，确保程序不崩溃
+
+
+async def get_llm_scores_batched(items):
+    """
+    一次请求对多个标的进行分析和打分
+    items 为 (etf_data, daily_trend_data) 列表，返回与输入顺序一致的 (score, comment) 列表
+    """
+    if client is None:
+        return [(None, "LLM服务未配置或初始化失败。")] * len(items)
+
+    model = LLM_MODEL_NAME
+    combined_list = [_build_combined_data(etf_data, daily_trend_data) for etf_data, daily_trend_data in items]
+    cache_keys = [_llm_cache_key(model, combined_data) for combined_data in combined_list]
+    results = [llm_cache.get(cache_key) for cache_key in cache_keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if len(pending) <= 1:
+        for i in pending:
+            results[i] = await get_llm_score_and_analysis(*items[i])
+        return results
+
+    try:
+        await _pacer.wait()
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+                {"role": "user", "content": json.dumps([combined_list[i] for i in pending], ensure_ascii=False, separators=_COMPACT_SEPARATORS)}
+            ],
+            response_format=_BATCH_RESPONSE_FORMAT
+        )
+        raw_content = response.choices[0].message.content
+        parsed_json = json.loads(raw_content) if raw_content else {}
+        batch_items = parsed_json.get('results', []) if isinstance(parsed_json, dict) else parsed_json
+        results_by_code = {
+            str(item.get('code')): item for item in batch_items if isinstance(item, dict)
+        } if isinstance(batch_items, list) else {}
+        for i in pending:
+            result_dict = results_by_code.get(str(items[i][0].get('code')))
+            if result_dict is None:
+                continue
+            results[i] = _score_and_comment(result_dict)
+            llm_cache.set(cache_keys[i], results[i], expire=LLM_CACHE_EXPIRE)
+    except json.JSONDecodeError as e:
+        # 请求本身成功但批量输出不是合法JSON（多见于长输出被截断），交由下方逐个分析
+        logger.warning(f"LLM批量响应无法解析为JSON，改为逐个分析: {e}")
+    except Exception as e:
+        logger.error(f"批量调用或解析LLM响应时出错: {e}", exc_info=True)
+        return [result if result is not None else (50, f"LLM分析服务异常: {e}") for result in results]
+
+    # 批量结果中缺失的标的逐个补充分析
+    for i in pending:
+        if results[i] is None:
+            logger.warning(f"LLM批量结果中缺少 {items[i][0].get('name')}，单独进行分析")
+            results[i] = await get_llm_score_and_analysis(*items[i])
+    return results
@@ -1,10 +1,16 @@
 import asyncio
 import logging
 import os
+import queue
+import signal
 import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 from dotenv import load_dotenv
 from bot_handler import setup_handlers  
+from ak_utils import close_http_client
+from llm_analyzer import close_llm_client
+from analysis import shutdown_process_pool
 from telegram.ext import Application, ApplicationBuilder
 
 
@@ -32,12 +38,41 @@ logger.setLevel(logging.INFO)
 # 控制台处理器
 console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setFormatter(log_formatter)
-logger.addHandler(console_handler)
 
-# 文件处理器 (写入到 bot.log 文件)
-file_handler = logging.FileHandler("bot.log", mode='a', encoding='utf-8')
+# 文件处理器 (写入到 bot.log 文件，单个文件超过10MB时轮转，保留5个备份)
+file_handler = RotatingFileHandler("bot.log", mode='a', maxBytes=10_000_000, backupCount=5,
+                                   encoding='utf-8', delay=True)
 file_handler.setFormatter(log_formatter)
-logger.addHandler(file_handler)
+
+# 日志记录先放入队列，由后台线程写入控制台和文件，避免磁盘I/O阻塞事件循环
+log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, console_handler, file_handler)
+
+
+def select_event_loop():
+    """选择事件循环实现：优先 uringcore（io_uring），其次 uvloop，均未安装时使用标准库 asyncio
+    返回 (名称, 事件循环工厂, 事件循环策略类)，使用标准库时后两者为 None"""
+    try:
+        import uringcore
+        return "uringcore", lambda: uringcore.EventLoopPolicy().new_event_loop(), uringcore.EventLoopPolicy
+    except ImportError:
+        pass
+    try:
+        import uvloop
+        return "uvloop", uvloop.new_event_loop, uvloop.EventLoopPolicy
+    except ImportError:
+        return "asyncio", None, None
+
+
+def run_event_loop(coro, loop_factory, policy_cls):
+    """Python 3.11+ 通过 asyncio.Runner 指定事件循环工厂（事件循环策略在3.14起已弃用）；更早版本退回设置事件循环策略"""
+    if hasattr(asyncio, "Runner"):
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            return runner.run(coro)
+    if policy_cls is not None:
+        asyncio.set_event_loop_policy(policy_cls())
+    return asyncio.run(coro)
 
 
 async def main():
@@ -52,14 +87,30 @@ async def main():
             await application.start()
             await application.updater.start_polling()
             
-            while True:
-                await asyncio.sleep(3600)
+            # 空闲时不再定期唤醒事件循环，收到 SIGINT/SIGTERM 后再按顺序停止轮询和应用
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop_event.set)
+                except (NotImplementedError, RuntimeError):
+                    # Windows 不支持 add_signal_handler，仍由 Ctrl+C 触发 KeyboardInterrupt
+                    pass
+            try:
+                await stop_event.wait()
+                logger.info("🛑 收到中断信号，机器人正在停止...")
+            finally:
+                await application.updater.stop()
+                await application.stop()
 
     except (KeyboardInterrupt, SystemExit):
         logger.info("🛑 收到中断信号，机器人正在停止...")
     except Exception as e:
         logger.error(f"❌ 机器人运行出错: {e}", exc_info=True)
     finally:
+        await close_http_client()
+        await close_llm_client()
+        shutdown_process_pool()
         logger.info("🛑 机器人已停止。")
 
 
@@ -70,7 +121,14 @@ if __name__ == "__main__":
     os.chdir(Path(__file__).parent)
     print(f"工作目录: {os.getcwd()}")
     
+    loop_name, loop_factory, loop_policy_cls = select_event_loop()
+    print(f"事件循环: {loop_name}")
+
+    log_listener.start()
     try:
-        asyncio.run(main())
+        run_event_loop(main(), loop_factory, loop_policy_cls)
     except Exception as e:
         print(f"❌ 启动失败: {e}")
+    finally:
+        # 事件循环关闭后再停止监听线程，写出队列中剩余的日志（包括 Runner 收尾时的警告）
+        log_listener.stop()
@@ -0,0 +1,27 @@
+# rate_limiter.py (上游服务共用的异步令牌桶限流)
+
+import asyncio
+
+
+class TokenBucket:
+    """令牌桶限流：每秒匀速补充 rate 个令牌，桶容量为 burst，令牌用尽时请求才排队等待；rate<=0 表示不限制"""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = float(burst)
+        self._tokens = float(burst)
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._updated is not None:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 先预占令牌，令牌为负时按欠缺量计算等待时间，并发请求依次排队
+            self._tokens -= 1
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            await asyncio.sleep(delay)